@@ -7,4 +7,4 @@
 from birdr import view
 
 if __name__ == "__main__":
-    view.main()
+    view.run()
@@ -6,16 +6,25 @@
 
 from __future__ import annotations
 
+import bisect
+import collections
 import dataclasses
 import datetime
+import functools
+import logging
 import os
 import pathlib
-import readline
 import typing as T
 
-from birdr.model import Model, Species, Transaction
+if T.TYPE_CHECKING:
+    from birdr.model import Model, Transaction
 
+# Version of the checklist cache's contents; bump it whenever ChecklistData
+# or CategoryData change, so pickles from older versions are not loaded.
+_CACHE_FORMAT = 3
 
+
+@functools.lru_cache(maxsize=1)
 def get_database_path() -> pathlib.Path:
     """Get the path to the user's local database file."""
     return (
@@ -28,9 +37,53 @@ def get_database_path() -> pathlib.Path:
     )
 
 
+@functools.lru_cache(maxsize=1)
+def get_cache_path() -> pathlib.Path:
+    """Get the path to the user's local cache directory."""
+    return (
+        pathlib.Path(
+            os.environ.get("XDG_CACHE_HOME", os.path.expanduser("~/.cache"))
+        )
+        / "birdr"
+    )
+
+
+def _get_database_version() -> T.Tuple[int, ...]:
+    """Identify the current contents of the database from its files.
+
+    Committed writes may still be sitting in the write-ahead log, so its
+    modification time and size are part of the version as well.
+    """
+    database = get_database_path()
+    version: T.List[int] = []
+    for path in (database, database.with_name(f"{database.name}-wal")):
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            version += [0, 0]
+        else:
+            version += [stat.st_mtime_ns, stat.st_size]
+    return tuple(version)
+
+
+@functools.lru_cache(maxsize=1)
+def _get_model() -> Model:
+    """Get the model for the user's database, shared by all operations.
+
+    The model (and SQLAlchemy with it) is only imported once a command
+    actually needs the database. Databases created by older versions are
+    upgraded before they are first used.
+    """
+    from birdr.model import Model
+
+    model = Model(get_database_path())
+    model.upgrade()
+    return model
+
+
 def init(*, ebird_list: T.Optional[pathlib.Path] = None) -> None:
     """Initialize the bird database."""
-    eng = Model(get_database_path())
+    eng = _get_model()
     eng.create()
 
     if ebird_list is not None:
@@ -38,98 +91,185 @@ def init(*, ebird_list: T.Optional[pathlib.Path] = None) -> None:
             transaction.load_ebird_list(filp)
 
 
-def add(
-    *, date: datetime.date, location: str, species: str, notes: str
+def add_many(
+    *, observations: T.Iterable[T.Tuple[datetime.date, str, str, str]]
 ) -> None:
-    """Add a new sighting to the database."""
-    with Model(get_database_path()).transaction() as transaction:
-        transaction.add_sighting(date, species, location, notes)
+    """Add a sequence of observations without prompting.
+
+    All of the observations are read and their species looked up before any
+    are written, and they are added in a single transaction: if any line is
+    invalid or names an unrecognized species, none of them are added.
+    """
+    with _get_model().transaction() as transaction:
+        transaction.add_sightings(observations)
 
 
 class SpeciesCompleter:
-    """Readline tab completion engine for species."""
+    """Readline tab completion engine for species.
+
+    The species names are loaded once when the engine is activated, so
+    completing doesn't need to query the database on every tab press.
+    """
 
     def __init__(self, transaction: Transaction) -> None:
         """Initialize the engine using the given transaction."""
         self.transaction = transaction
-        self.current: T.Optional[T.Iterator[Species]] = None
+        self.names: T.List[str] = []
+        self.keys: T.List[str] = []
+        self.current: T.Optional[T.Iterator[str]] = None
+
+    def _matching_names(self, text: str) -> T.Iterator[str]:
+        """Iterate through the species names starting with TEXT.
+
+        Matching ignores case, as resolving a species name does.
+        """
+        prefix = text.lower()
+        index = bisect.bisect_left(self.keys, prefix)
+        while index < len(self.keys) and self.keys[index].startswith(prefix):
+            yield self.names[index]
+            index += 1
+
+    def resolve(self, name: str) -> T.Optional[str]:
+        """Find the species called NAME, ignoring case as completion does.
+
+        Return the species' name as stored in the database, or None if there
+        is no such species.
+        """
+        key = name.lower()
+        index = bisect.bisect_left(self.keys, key)
+        if index < len(self.keys) and self.keys[index] == key:
+            return self.names[index]
+        return None
 
     def readline_completer(self, text: str, state: int) -> T.Optional[str]:
-        """Complete the given text line by query the database."""
+        """Complete the given text line from the cached species names."""
         if state == 0:
-            self.current = iter(self.transaction.lookup_matching_species(text))
+            self.current = self._matching_names(text)
         assert self.current is not None
-        species = next(self.current)
-        if species is None:
-            return None
-        return species.name
+        return next(self.current, None)
 
-    def __enter__(self) -> None:
+    def __enter__(self) -> SpeciesCompleter:
         """Activate this readline completion engine in a context."""
+        import readline
+
+        self.names = sorted(
+            self.transaction.lookup_species_names(), key=str.lower
+        )
+        self.keys = [name.lower() for name in self.names]
         readline.parse_and_bind("tab: complete")
         readline.set_completer_delims("")
         readline.set_completer(self.readline_completer)
+        return self
 
     def __exit__(self, *_excinfo: T.Any) -> None:
         """De-activate the completion engine on exit."""
+        import readline
+
         readline.set_completer(None)
 
 
 def add_observations(
     *, observations: T.Iterable[T.Tuple[datetime.date, str, str, str]]
 ) -> None:
-    """Add a sequence of observations from the given iterator."""
-    with Model(
-        get_database_path()
-    ).transaction() as transaction, SpeciesCompleter(transaction):
-        for (date, location, species, notes) in observations:
-            transaction.add_sighting(date, species, location, notes)
+    """Add a sequence of observations from the given iterator.
+
+    Each species is checked as soon as its observation is entered; any that
+    are not recognized are reported and skipped. The rest are added together
+    once the input is finished.
+    """
+    model = _get_model()
+    with model.transaction() as transaction, SpeciesCompleter(
+        transaction
+    ) as completer:
+        transaction.add_sightings(
+            _recognized_observations(observations, completer)
+        )
+
+
+def _recognized_observations(
+    observations: T.Iterable[T.Tuple[datetime.date, str, str, str]],
+    completer: SpeciesCompleter,
+) -> T.Iterator[T.Tuple[datetime.date, str, str, str]]:
+    """Filter out observations of species that are not in the database."""
+    for (date, location, species, notes) in observations:
+        name = completer.resolve(species)
+        if name is None:
+            logging.error("%s is not a recognized species; skipping", species)
+            continue
+        yield (date, location, name, notes)
 
 
 def create_checklist(*, name: str, species: T.Iterable[str]) -> None:
-    """Create a new checklist in the database."""
-    with Model(
-        get_database_path()
-    ).transaction() as transaction, SpeciesCompleter(transaction):
+    """Create a new checklist in the database.
+
+    Species that are not recognized are reported and left out.
+    """
+    model = _get_model()
+    with model.transaction() as transaction, SpeciesCompleter(
+        transaction
+    ) as completer:
         transaction.add_checklist(name)
-        for spec in species:
-            transaction.add_species_to_checklist(name, spec)
+        transaction.add_many_species_to_checklist(
+            name, _recognized_species(species, completer)
+        )
+
 
+def _recognized_species(
+    species: T.Iterable[str], completer: SpeciesCompleter
+) -> T.Iterator[str]:
+    """Filter out the names of species that are not in the database."""
+    for spec in species:
+        if not spec:
+            continue
+        name = completer.resolve(spec)
+        if name is None:
+            logging.error("%s is not a recognized species; skipping", spec)
+            continue
+        yield name
 
-def get_checklists() -> T.Iterator[str]:
+
+def get_checklists() -> T.List[str]:
     """Get the names of all checklists in the database."""
-    with Model(get_database_path()).transaction() as transaction:
-        for checklist in transaction.lookup_checklist_names():
-            yield checklist
+    with _get_model().transaction() as transaction:
+        return list(transaction.lookup_checklist_names())
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class CategoryData:
     """High-level representation of a category of birds."""
 
-    seen: T.Set[str]
-    unseen: T.Set[str]
+    # Every species in the category (with whether it was seen), by name.
+    sorted_species: T.Tuple[T.Tuple[str, bool], ...]
     complete: float = 0.0
 
-    def add_seen(self, species: str) -> CategoryData:
-        """Return a new category data with an additional observed species."""
-        return CategoryData(
-            seen=self.seen | {species},
-            unseen=self.unseen,
-            complete=(len(self.seen) + 1)
-            / (len(self.seen) + len(self.unseen) + 1),
-        )
 
-    def add_unseen(self, species: str) -> CategoryData:
-        """Return a new category data with an additional unobserved species."""
+@dataclasses.dataclass
+class _CategoryBuilder:
+    """Mutable accumulator used while building up a CategoryData.
+
+    Species must be added in order by name.
+    """
+
+    num_seen: int = 0
+    species: T.List[T.Tuple[str, bool]] = dataclasses.field(
+        default_factory=list
+    )
+
+    def add(self, species: str, seen: bool) -> None:
+        """Add a species to the category, either observed or not."""
+        if seen:
+            self.num_seen += 1
+        self.species.append((species, seen))
+
+    def build(self) -> CategoryData:
+        """Freeze the accumulated species into a new category data."""
         return CategoryData(
-            seen=self.seen,
-            unseen=self.unseen | {species},
-            complete=len(self.seen) / (len(self.seen) + len(self.unseen) + 1),
+            sorted_species=tuple(self.species),
+            complete=self.num_seen / len(self.species),
         )
 
 
-@dataclasses.dataclass(frozen=True)
+@dataclasses.dataclass(frozen=True, slots=True)
 class ChecklistData:
     """High-level representation of a set of species (grouped by category)."""
 
@@ -138,31 +278,116 @@ class ChecklistData:
 
 
 def get_checklist_data(*, checklist: str) -> T.Optional[ChecklistData]:
-    """Get structured data for a given checklist."""
-    with Model(get_database_path()).transaction() as transaction:
+    """Get structured data for a given checklist.
+
+    The data is cached on disk until the database changes, so showing the
+    same checklist again doesn't need to query the database.
+    """
+    import hashlib
+    import pickle
+    import tempfile
+
+    key = (_CACHE_FORMAT, _get_database_version())
+    # Checklist names are arbitrary text, so the file is named by a digest.
+    digest = hashlib.sha256(checklist.encode("utf-8")).hexdigest()
+    cache_file = get_cache_path() / f"checklist-{digest}.pickle"
+    try:
+        with cache_file.open("rb") as filp:
+            # The key is pickled ahead of the data, so a cache written by
+            # another version is never unpickled past its key.
+            if pickle.load(filp) == key:
+                return T.cast(ChecklistData, pickle.load(filp))
+    except (
+        OSError,
+        EOFError,
+        pickle.UnpicklingError,
+        AttributeError,
+        ImportError,
+        TypeError,
+        ValueError,
+    ):
+        # A missing, unreadable or outdated cache is simply rebuilt.
+        pass
+
+    data = _load_checklist_data(checklist=checklist)
+    if data is not None:
+        # The cache is only an optimization; failing to write it is not an
+        # error.
+        try:
+            cache_file.parent.mkdir(parents=True, exist_ok=True)
+            # Every writer gets its own temporary file, so concurrent runs
+            # can't mix their writes before the cache is replaced.
+            tmp_fd, tmp_name = tempfile.mkstemp(
+                dir=cache_file.parent, suffix=".tmp"
+            )
+            try:
+                with os.fdopen(tmp_fd, "wb") as filp:
+                    pickle.dump(key, filp)
+                    pickle.dump(data, filp)
+                os.replace(tmp_name, cache_file)
+            except BaseException:
+                os.unlink(tmp_name)
+                raise
+        except OSError:
+            pass
+    return data
+
+
+def _load_checklist_data(*, checklist: str) -> T.Optional[ChecklistData]:
+    """Query the database for a checklist's structured data."""
+    with _get_model().transaction() as transaction:
         num_seen = 0
         num_total = 0
-        categories: T.Dict[str, CategoryData] = {}
+        categories: T.DefaultDict[str, _CategoryBuilder] = (
+            collections.defaultdict(_CategoryBuilder)
+        )
 
         checklist_data = transaction.lookup_checklist(checklist)
         if checklist_data is None:
             return None
 
         for (species, category, seen) in checklist_data:
-            category_data = categories.get(category) or CategoryData(
-                set(), set()
-            )
-            new_category = (
-                category_data.add_seen(species)
-                if seen
-                else category_data.add_unseen(species)
-            )
-            categories[category] = new_category
+            categories[category].add(species, seen)
 
             num_total += 1
             if seen:
                 num_seen += 1
 
         return ChecklistData(
-            categories=categories, complete=num_seen / num_total
+            categories={
+                category: builder.build()
+                for category, builder in categories.items()
+            },
+            complete=num_seen / num_total if num_total else 0.0,
+        )
+
+
+@dataclasses.dataclass(frozen=True, slots=True)
+class ChecklistProgress:
+    """Completion of a checklist and of each of its categories."""
+
+    categories: T.Dict[str, float]
+    complete: float = 0.0
+
+
+def get_checklist_progress(*, checklist: str) -> T.Optional[ChecklistProgress]:
+    """Get the completion of a checklist without loading its species."""
+    with _get_model().transaction() as transaction:
+        num_seen = 0
+        num_total = 0
+        categories: T.Dict[str, float] = {}
+
+        progress = transaction.lookup_checklist_progress(checklist)
+        if progress is None:
+            return None
+
+        for (category, seen, total) in progress:
+            categories[category] = seen / total
+
+            num_total += total
+            num_seen += seen
+
+        return ChecklistProgress(
+            categories=categories,
+            complete=num_seen / num_total if num_total else 0.0,
         )
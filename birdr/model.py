@@ -4,17 +4,23 @@
 
 """Data model for the birdr database."""
 import contextlib
-import csv
 import datetime
 import dataclasses
 import pathlib
 import typing as T
 
 import sqlalchemy
-from sqlalchemy.orm import declarative_base, relationship, session
+from sqlalchemy.orm import (
+    DeclarativeBase,
+    Mapped,
+    mapped_column,
+    relationship,
+    session,
+)
 
 
-Base = declarative_base()
+class Base(DeclarativeBase):
+    """Base class for all the tables in the database."""
 
 
 class Species(Base):
@@ -22,17 +28,20 @@ class Species(Base):
 
     __tablename__ = "species"
 
-    # TODO: typing information with sqlalchemy-2.0
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
-    name = sqlalchemy.Column(sqlalchemy.String, unique=True, nullable=False)
-    category_id = sqlalchemy.Column(
-        sqlalchemy.Integer, sqlalchemy.ForeignKey("category.id")
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
+    category_id: Mapped[T.Optional[int]] = mapped_column(
+        sqlalchemy.ForeignKey("category.id")
     )
 
-    category = relationship("Category", back_populates="species")
-    sightings = relationship("Sighting", back_populates="species")
-    checklists = relationship(
-        "Checklist", secondary="species_checklist", back_populates="species"
+    category: Mapped[T.Optional["Category"]] = relationship(
+        back_populates="species"
+    )
+    sightings: Mapped[T.List["Sighting"]] = relationship(
+        back_populates="species"
+    )
+    checklists: Mapped[T.List["Checklist"]] = relationship(
+        secondary="species_checklist", back_populates="species"
     )
 
 
@@ -41,10 +50,10 @@ class Category(Base):
 
     __tablename__ = "category"
 
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
-    name = sqlalchemy.Column(sqlalchemy.String, unique=True, nullable=False)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
 
-    species = relationship("Species", back_populates="category")
+    species: Mapped[T.List[Species]] = relationship(back_populates="category")
 
 
 class Sighting(Base):
@@ -52,17 +61,17 @@ class Sighting(Base):
 
     __tablename__ = "sightings"
 
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
-    year = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
-    month = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
-    day = sqlalchemy.Column(sqlalchemy.Integer, nullable=False)
-    location = sqlalchemy.Column(sqlalchemy.String, nullable=False)
-    species_id = sqlalchemy.Column(
-        sqlalchemy.Integer, sqlalchemy.ForeignKey("species.id")
+    id: Mapped[int] = mapped_column(primary_key=True)
+    date: Mapped[datetime.date] = mapped_column(index=True)
+    location: Mapped[str]
+    species_id: Mapped[T.Optional[int]] = mapped_column(
+        sqlalchemy.ForeignKey("species.id"), index=True
     )
-    notes = sqlalchemy.Column(sqlalchemy.String)
+    notes: Mapped[T.Optional[str]]
 
-    species = relationship("Species", back_populates="sightings")
+    species: Mapped[T.Optional[Species]] = relationship(
+        back_populates="sightings"
+    )
 
 
 class Checklist(Base):
@@ -70,11 +79,11 @@ class Checklist(Base):
 
     __tablename__ = "checklist"
 
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
-    name = sqlalchemy.Column(sqlalchemy.String, unique=True, nullable=False)
+    id: Mapped[int] = mapped_column(primary_key=True)
+    name: Mapped[str] = mapped_column(unique=True)
 
-    species = relationship(
-        "Species", secondary="species_checklist", back_populates="checklists"
+    species: Mapped[T.List[Species]] = relationship(
+        secondary="species_checklist", back_populates="checklists"
     )
 
 
@@ -86,16 +95,30 @@ class SpeciesChecklist(Base):
     """
 
     __tablename__ = "species_checklist"
+    __table_args__ = (
+        sqlalchemy.Index(
+            "ix_species_checklist_checklist_id_species_id",
+            "checklist_id",
+            "species_id",
+        ),
+    )
 
-    id = sqlalchemy.Column(sqlalchemy.Integer, primary_key=True)
-    species_id = sqlalchemy.Column(
-        sqlalchemy.Integer, sqlalchemy.ForeignKey("species.id")
+    id: Mapped[int] = mapped_column(primary_key=True)
+    species_id: Mapped[T.Optional[int]] = mapped_column(
+        sqlalchemy.ForeignKey("species.id")
     )
-    checklist_id = sqlalchemy.Column(
-        sqlalchemy.Integer, sqlalchemy.ForeignKey("checklist.id")
+    checklist_id: Mapped[T.Optional[int]] = mapped_column(
+        sqlalchemy.ForeignKey("checklist.id")
     )
 
 
+# The checklist lookup runs on every checklist operation, so it is built once;
+# SQLAlchemy caches its compiled form on the engine, keyed by the statement.
+_CHECKLIST_BY_NAME = sqlalchemy.select(Checklist).where(
+    Checklist.name == sqlalchemy.bindparam("name")
+)
+
+
 class UnrecognizedSpecies(Exception):
     """An unrecognized species was found."""
 
@@ -109,128 +132,276 @@ class Transaction:
     def lookup_checklist(
         self, checklist_name: str
     ) -> T.Optional[T.Iterator[T.Tuple[str, str, bool]]]:
-        """Iterate through all species in a checklist."""
+        """Iterate through all species in a checklist, ordered by name.
+
+        Each species is returned with its category and whether it has been
+        seen, all in a single query.
+        """
         checklist = self._lookup_checklist_by_name(checklist_name)
         if checklist is None:
             return None
 
-        return map(
-            lambda species: (
-                species.name,
-                species.category.name,
-                len(species.sightings) > 0,
-            ),
-            checklist.species,
+        seen = sqlalchemy.exists().where(Sighting.species_id == Species.id)
+        return iter(
+            self.session.execute(
+                sqlalchemy.select(Species.name, Category.name, seen)
+                .join(Species.category)
+                .join(
+                    SpeciesChecklist, SpeciesChecklist.species_id == Species.id
+                )
+                .where(SpeciesChecklist.checklist_id == checklist.id)
+                .order_by(Species.name)
+            ).tuples()
+        )
+
+    def lookup_checklist_progress(
+        self, checklist_name: str
+    ) -> T.Optional[T.Iterator[T.Tuple[str, int, int]]]:
+        """Count the seen and total species in each category of a checklist.
+
+        The counting is done by the database, so the species themselves are
+        never loaded.
+        """
+        checklist = self._lookup_checklist_by_name(checklist_name)
+        if checklist is None:
+            return None
+
+        seen = sqlalchemy.exists().where(Sighting.species_id == Species.id)
+        return iter(
+            self.session.execute(
+                sqlalchemy.select(
+                    Category.name,
+                    sqlalchemy.func.sum(sqlalchemy.case((seen, 1), else_=0)),
+                    sqlalchemy.func.count(),
+                )
+                .select_from(Species)
+                .join(Species.category)
+                .join(
+                    SpeciesChecklist, SpeciesChecklist.species_id == Species.id
+                )
+                .where(SpeciesChecklist.checklist_id == checklist.id)
+                .group_by(Category.id)
+            ).tuples()
         )
 
     def lookup_checklist_names(self) -> T.Iterator[str]:
         """Iterate through all the checklists in the database."""
-        return map(
-            lambda checklist: checklist.name, self.session.query(Checklist)
+        return iter(
+            self.session.execute(sqlalchemy.select(Checklist.name)).scalars()
         )
 
     def load_ebird_list(self, ebird_list: T.TextIO) -> None:
-        """Load the ebird species list."""
-        categories: T.Dict[str, Category] = {}
+        """Load the ebird species list.
+
+        The list is large and comes from a trusted file, so the rows are
+        inserted in bulk through the DBAPI cursor rather than the ORM.
+        """
+        import csv
+
+        # Categories are numbered in the order they first appear; the species
+        # refer to them by that index until the real ids are known.
+        categories: T.Dict[str, int] = {}
+        species: T.List[T.Tuple[str, int]] = []
         csv_input = csv.reader(ebird_list)
 
-        # Note that the first line is the header; we are implicitly ignoring it
-        # with the 'species' check below.
+        # Skip the header line.
+        next(csv_input, None)
         for csv_line in csv_input:
             if csv_line[1] != "species":
                 continue
-            name = csv_line[3]
-            category_name = csv_line[7]
-
-            if category_name in categories:
-                category = categories[category_name]
-            else:
-                category = Category(name=category_name)
-                categories[category_name] = category
-
-            species = Species(name=name, category=category)
-
-            self.session.add(species)
-
-    def _lookup_species_by_name(self, species: str) -> sqlalchemy.orm.Query:
-        """Lookup SPECIES in the database, ordered alphabetically by name."""
-        return (
-            self.session.query(Species)
-            .filter(Species.name.like(species))
-            .order_by(Species.name)
+            category_index = categories.setdefault(
+                csv_line[7], len(categories)
+            )
+            species.append((csv_line[3], category_index))
+
+        if not species:
+            return
+
+        # Hand the rows straight to the sqlite3 cursor; it is still part of
+        # the session's transaction, but skips SQLAlchemy's per-row work.
+        cursor = self.session.connection().connection.cursor()
+        cursor.executemany(
+            "INSERT INTO category (name) VALUES (?)",
+            [(category_name,) for category_name in categories],
         )
+        cursor.execute("SELECT name, id FROM category")
+        ids_by_name = dict(cursor.fetchall())
+        category_ids = [ids_by_name[name] for name in categories]
+        cursor.executemany(
+            "INSERT INTO species (name, category_id) VALUES (?, ?)",
+            [
+                (name, category_ids[category_index])
+                for (name, category_index) in species
+            ],
+        )
+        cursor.close()
 
-    def _lookup_one_species_by_name(self, species: str) -> T.Optional[Species]:
-        """Lookup a species by name."""
-        return self._lookup_species_by_name(species).one_or_none()
-
-    def lookup_matching_species(self, prefix: str) -> T.Iterable[Species]:
-        """Look up all the species that match the given PREFIX."""
-        return self._lookup_species_by_name(f"{prefix}%")
+    def lookup_species_names(self) -> T.List[str]:
+        """Get the names of all the species in the database."""
+        return list(
+            self.session.execute(sqlalchemy.select(Species.name)).scalars()
+        )
 
-    def add_sighting(
-        self, date: datetime.date, species: str, location: str, notes: str
+    def add_sightings(
+        self,
+        observations: T.Iterable[T.Tuple[datetime.date, str, str, str]],
     ) -> None:
-        """Add a new bird sighting in the database."""
-        species_obj = self._lookup_one_species_by_name(species)
-        if species_obj is None:
-            raise UnrecognizedSpecies(species)
-
-        sighting = Sighting(
-            year=date.year,
-            month=date.month,
-            day=date.day,
-            location=location,
-            species=species_obj,
-            notes=notes,
+        """Add a group of new bird sightings in the database.
+
+        Each observation is a (date, location, species, notes) tuple. All the
+        species are looked up together by their exact names, and the sightings
+        are then inserted together. Names that only differ in case from a
+        species are resolved as the species completer does.
+        """
+        observations = list(observations)
+        names = {species for (_, _, species, _) in observations}
+        species_ids = dict(
+            self.session.execute(
+                sqlalchemy.select(Species.name, Species.id).where(
+                    Species.name.in_(names)
+                )
+            ).all()
         )
-        self.session.add(sighting)
+
+        # Names without an exact match are compared against the whole species
+        # list in Python, since SQLite's lower() only folds ASCII.
+        unmatched = names - species_ids.keys()
+        if unmatched:
+            ids_by_key = {
+                name.lower(): species_id
+                for (name, species_id) in self.session.execute(
+                    sqlalchemy.select(Species.name, Species.id)
+                ).tuples()
+            }
+            for name in unmatched:
+                species_id = ids_by_key.get(name.lower())
+                if species_id is not None:
+                    species_ids[name] = species_id
+
+        sightings = []
+        for (date, location, species, notes) in observations:
+            species_id = species_ids.get(species)
+            if species_id is None:
+                raise UnrecognizedSpecies(species)
+            sightings.append(
+                {
+                    "date": date,
+                    "location": location,
+                    "species_id": species_id,
+                    "notes": notes,
+                }
+            )
+
+        if sightings:
+            self.session.execute(sqlalchemy.insert(Sighting), sightings)
 
     def add_checklist(self, name: str) -> None:
         """Create a new checklist in the database."""
         checklist = Checklist(name=name)
         self.session.add(checklist)
 
-    def _lookup_checklist_by_name(self, checklist: str) -> Checklist:
-        """Lookup SPECIES in the database, ordered alphabetically by name."""
-        return (
-            self.session.query(Checklist)
-            .filter(Checklist.name == checklist)
-            .one_or_none()
-        )
-
-    def add_species_to_checklist(self, checklist: str, species: str) -> bool:
-        """Add an existing species to a checklist.
-
-        Return True if the species was added successfully; False is it was not.
+    def _lookup_checklist_by_name(
+        self, checklist: str
+    ) -> T.Optional[Checklist]:
+        """Lookup a checklist by its exact name."""
+        return self.session.execute(
+            _CHECKLIST_BY_NAME, {"name": checklist}
+        ).scalar_one_or_none()
+
+    def add_many_species_to_checklist(
+        self, checklist: str, species: T.Iterable[str]
+    ) -> bool:
+        """Add a group of existing species to a checklist.
+
+        All the species are looked up in a single query; any that are not
+        recognized are skipped. Return True if the checklist exists; False if
+        it does not.
         """
         checklist_obj = self._lookup_checklist_by_name(checklist)
         if checklist_obj is None:
             return False
 
-        species_obj = self._lookup_one_species_by_name(species)
-        if species_obj is None:
-            return False
-
-        species_obj.checklists.append(checklist_obj)
+        species_ids = self.session.execute(
+            sqlalchemy.select(Species.id).where(Species.name.in_(set(species)))
+        ).scalars()
+        rows = [
+            {"checklist_id": checklist_obj.id, "species_id": species_id}
+            for species_id in species_ids
+        ]
+        if rows:
+            self.session.execute(sqlalchemy.insert(SpeciesChecklist), rows)
         return True
 
 
+def _migrate_sighting_dates(connection: sqlalchemy.Connection) -> None:
+    """Merge the year/month/day columns of older databases into a date.
+
+    SQLite can't add a NOT NULL column without a default, so the table is
+    rebuilt with the current schema and the sightings are copied into it.
+    """
+    connection.exec_driver_sql("ALTER TABLE sightings RENAME TO sightings_old")
+    connection.exec_driver_sql("DROP INDEX IF EXISTS ix_sightings_species_id")
+    Base.metadata.tables["sightings"].create(connection)
+    connection.exec_driver_sql(
+        "INSERT INTO sightings (id, date, location, species_id, notes)"
+        " SELECT id, printf('%04d-%02d-%02d', year, month, day), location,"
+        " species_id, notes FROM sightings_old"
+    )
+    connection.exec_driver_sql("DROP TABLE sightings_old")
+
+
+def _set_sqlite_pragmas(dbapi_connection: T.Any, _record: T.Any) -> None:
+    """Tune each new SQLite connection for faster reads and writes."""
+    cursor = dbapi_connection.cursor()
+    cursor.execute("PRAGMA journal_mode=WAL")
+    cursor.execute("PRAGMA synchronous=NORMAL")
+    cursor.execute("PRAGMA cache_size=-64000")
+    cursor.execute("PRAGMA temp_store=MEMORY")
+    cursor.execute("PRAGMA mmap_size=268435456")
+    cursor.close()
+
+
 class Model:
     """Main class for interfacing with the data model of birdr."""
 
     def __init__(self, path: pathlib.Path) -> None:
         """Initialize the engine for a new model interface."""
-        # TODO: remove future once on sqlalchemy-2.0
         self.path = path
         self.engine = sqlalchemy.create_engine(
-            f"sqlite+pysqlite:///{str(path)}", future=True
+            f"sqlite+pysqlite:///{str(path)}"
         )
+        sqlalchemy.event.listen(self.engine, "connect", _set_sqlite_pragmas)
 
     def create(self) -> None:
         """Create the tables in the database if necessary."""
         self.path.parent.mkdir(parents=True, exist_ok=True)
         Base.metadata.create_all(self.engine)
+        self.upgrade()
+
+        # create_all() skips tables that already exist, so add any indexes
+        # that are missing from databases created by older versions.
+        for table in Base.metadata.sorted_tables:
+            for index in table.indexes:
+                index.create(self.engine, checkfirst=True)
+
+    def upgrade(self) -> None:
+        """Update the tables of a database created by an older version.
+
+        When the schema is already current this is a single query, so it is
+        cheap enough to run before every use of the database.
+        """
+        if not self.path.exists():
+            return
+
+        with self.engine.begin() as connection:
+            columns = {
+                row[1]
+                for row in connection.exec_driver_sql(
+                    "PRAGMA table_info(sightings)"
+                )
+            }
+            if columns and "date" not in columns:
+                _migrate_sighting_dates(connection)
 
     @contextlib.contextmanager
     def transaction(self) -> T.Iterator[Transaction]:
@@ -4,24 +4,32 @@
 
 """User interface for viewing/manipulating the birdr database."""
 
+from __future__ import annotations
+
+import bisect
 import datetime
+import functools
 import logging
 import os
 import pathlib
 import re
-import subprocess
+import signal
 import sys
-import tempfile
 import typing as T
 
 import click
-import rich
-import rich.tree
 
 from birdr import controller
 
+# rich is only needed to render checklists, so it is imported by the commands
+# that do so rather than by every invocation.
+if T.TYPE_CHECKING:
+    import rich.text
+
 VERSION = "0.1.1"
 
+_DATE_RE = re.compile(r"([0-9]{4})/([0-9]{1,2})/([0-9]{1,2})")
+
 
 @click.group()
 def main() -> None:
@@ -56,7 +64,8 @@ def add(non_interactive: bool = False) -> None:
 
     When adding non-interactively, sighting data is read through stdin. Each
     line is a single entry containing the date (in YYYY/MM/DD format),
-    location, species name, and notes (all separated by nil characters).
+    location, species name, and notes (all separated by nil characters). If
+    any line is invalid, none of the sightings are added.
     """
     if non_interactive:
         _add_non_interactive()
@@ -64,17 +73,40 @@ def add(non_interactive: bool = False) -> None:
         _add_interactive()
 
 
+# Sightings in a bulk import mostly share a handful of dates, so remember the
+# recently parsed ones.
+@functools.lru_cache(maxsize=1024)
 def _parse_date(date_str: str) -> datetime.date:
-    return datetime.datetime.strptime(date_str, "%Y/%m/%d").date()
+    # The format is fixed (YYYY/MM/DD), so match it with a precompiled pattern
+    # rather than paying for strptime() on every line of a bulk import.
+    match = _DATE_RE.fullmatch(date_str)
+    if match is None:
+        raise ValueError(f"{date_str} is not in YYYY/MM/DD format")
+    return datetime.date(int(match[1]), int(match[2]), int(match[3]))
+
+
+def _parse_observations(
+    lines: T.Iterable[bytes],
+) -> T.Iterator[T.Tuple[datetime.date, str, str, str]]:
+    # Split the raw bytes and decode each field once, rather than decoding
+    # the whole line up front and copying it again to split it.
+    for line in lines:
+        # Tolerate CRLF line endings and stray whitespace around the date and
+        # notes, as stripping the whole line used to.
+        line = line.rstrip(b"\r")
+        if not line:
+            continue
+        [date_str, location, species, notes] = (
+            field.decode("utf-8") for field in line.split(b"\0", 3)
+        )
+        yield (_parse_date(date_str.strip()), location, species, notes.strip())
 
 
 def _add_non_interactive() -> None:
-    for line in sys.stdin:
-        [date_str, location, species, notes] = line.strip().split("\0")
-        date = _parse_date(date_str)
-        controller.add(
-            date=date, location=location, species=species, notes=notes
-        )
+    # Read all of the piped input at once and split it in memory, rather
+    # than reading it back line by line.
+    lines = sys.stdin.buffer.read().split(b"\n")
+    controller.add_many(observations=_parse_observations(lines))
 
 
 class InputIterator:
@@ -83,6 +115,7 @@ class InputIterator:
     def __init__(self, prompt: str) -> None:
         """Create a new input interator using the given prompt."""
         self.prompt = prompt
+        self.interactive = sys.stdin.isatty()
 
     def __iter__(self) -> T.Iterator[str]:
         """Get the iterator object."""
@@ -90,6 +123,13 @@ class InputIterator:
 
     def __next__(self) -> str:
         """Get the next prompted entry from the input."""
+        if not self.interactive:
+            # Piped input needs no prompt, but is cleaned up like typed input.
+            line = sys.stdin.readline()
+            if not line:
+                raise StopIteration
+            return line.strip()
+
         try:
             return input(self.prompt).strip()
         except EOFError as exc:
@@ -97,15 +137,25 @@ class InputIterator:
 
 
 class ObservationIterator:
-    """Iterate over input to generate observations."""
+    """Iterate over input to generate observations.
+
+    Notes for every observation are edited in the same temporary file, which
+    is removed when the iterator is used as a context manager and exits.
+    """
 
     def __init__(self, date: datetime.date, location: str) -> None:
         """Create a new iterator for generating observations."""
+        import shutil
+        import tempfile
+
         self.date = date
         self.location = location
         self.input_iter = iter(InputIterator("species? "))
         self.editor = os.environ.get("EDITOR", "vi")
-        self.whitespace_sub = re.compile(r"\s+")
+        # Resolve the editor once; posix_spawn() doesn't search PATH itself.
+        self.editor_path = shutil.which(self.editor) or self.editor
+        notes_fd, self.notes_path = tempfile.mkstemp(prefix="birdr-")
+        os.close(notes_fd)
 
     def __iter__(self) -> T.Iterator[T.Tuple[datetime.date, str, str, str]]:
         """Get the iterator object."""
@@ -115,20 +165,47 @@ class ObservationIterator:
         """Get the next observation."""
         species = next(self.input_iter)
 
-        with tempfile.NamedTemporaryFile(mode="r") as notes_file:
-            result = subprocess.call([self.editor, notes_file.name])
-            if result != 0:
-                logging.error(
-                    "%s exited unsuccessfully; aborting", self.editor
-                )
-                raise StopIteration
+        os.truncate(self.notes_path, 0)
+        if self._edit_notes() != 0:
+            logging.error("%s exited unsuccessfully; aborting", self.editor)
+            raise StopIteration
 
-            notes = re.sub(self.whitespace_sub, " ", notes_file.read()).strip()
-            if not notes:
-                raise StopIteration
+        # Open the file again after editing; editors that save by renaming a
+        # new file into place would leave an earlier handle on the old one.
+        with open(self.notes_path, encoding="utf-8") as notes_file:
+            notes = " ".join(notes_file.read().split())
+        if not notes:
+            raise StopIteration
 
         return (self.date, self.location, species, notes)
 
+    def _edit_notes(self) -> int:
+        """Run the editor on the notes file and return its exit code."""
+        # Python ignores SIGPIPE and SIGXFSZ; restore their defaults for the
+        # editor, as subprocess does.
+        pid = os.posix_spawn(
+            self.editor_path,
+            [self.editor, self.notes_path],
+            os.environ,
+            setsigdef=(signal.SIGPIPE, signal.SIGXFSZ),
+        )
+        try:
+            _, status = os.waitpid(pid, 0)
+        except BaseException:
+            # Don't leave the editor running if we are interrupted.
+            os.kill(pid, signal.SIGKILL)
+            os.waitpid(pid, 0)
+            raise
+        return os.waitstatus_to_exitcode(status)
+
+    def __enter__(self) -> ObservationIterator:
+        """Use this iterator in a context that cleans up the notes file."""
+        return self
+
+    def __exit__(self, *_excinfo: T.Any) -> None:
+        """Remove the temporary notes file on exit."""
+        os.unlink(self.notes_path)
+
 
 def _add_interactive() -> None:
     date_str = input("date? ")
@@ -140,9 +217,8 @@ def _add_interactive() -> None:
 
     location = input("location? ")
 
-    controller.add_observations(
-        observations=ObservationIterator(date, location)
-    )
+    with ObservationIterator(date, location) as observations:
+        controller.add_observations(observations=observations)
 
 
 @main.command()
@@ -162,43 +238,99 @@ def checklist(name: T.Optional[str] = None) -> None:
         )
 
 
-def _color_by_percent(text: str, percent: float) -> str:
-    if percent <= 0.25:
-        color = "red"
-    elif percent <= 0.50:
-        color = "bright_red"
-    elif percent <= 0.75:
-        color = "yellow"
-    else:
-        color = "green"
-    return f"[{color}]{text}[/{color}]"
+# Inclusive upper bound on the completion for each of the _arrows() below.
+_ARROW_THRESHOLDS = (0.25, 0.50, 0.75)
+
+
+# Tree labels are built from pre-rendered Text rather than markup strings, so
+# rich doesn't need to parse markup again for every species in a checklist.
+@functools.lru_cache(maxsize=1)
+def _arrows() -> T.Tuple[rich.text.Text, ...]:
+    import rich.text
+
+    return tuple(
+        rich.text.Text.from_markup(f"[{color}]:arrow_forward:[/{color}]")
+        for color in ("red", "bright_red", "yellow", "green")
+    )
+
+
+def _arrow_by_percent(percent: float) -> rich.text.Text:
+    return _arrows()[bisect.bisect_left(_ARROW_THRESHOLDS, percent)]
+
+
+def _progress_label(name: str, percent: float) -> rich.text.Text:
+    import rich.text
+
+    return rich.text.Text.assemble(
+        _arrow_by_percent(percent), f"{percent:4.0%} {name}"
+    )
 
 
 @main.command()
+@click.option(
+    "--summary",
+    "-s",
+    is_flag=True,
+    help="Only show the completion of each category.",
+)
 @click.argument("checklist_name", required=True)
-def show(checklist_name: str) -> None:
-    """Show the status of a checklist."""
+def show(checklist_name: str, summary: bool = False) -> None:
+    """Show the status of a checklist.
+
+    By default every species in the checklist is listed under its category.
+    With --summary, only the completion of each category is shown, which
+    avoids loading the species at all.
+    """
+    if summary:
+        _show_summary(checklist_name)
+    else:
+        _show_species(checklist_name)
+
+
+def _show_summary(checklist_name: str) -> None:
+    import rich
+    import rich.tree
+
+    progress = controller.get_checklist_progress(checklist=checklist_name)
+
+    if progress is None:
+        logging.error("%s is not a valid checklist", checklist_name)
+        sys.exit(1)
+
+    tree = rich.tree.Tree(_progress_label(checklist_name, progress.complete))
+    for category, complete in sorted(progress.categories.items()):
+        tree.add(_progress_label(category, complete))
+
+    rich.print(tree)
+
+
+def _show_species(checklist_name: str) -> None:
+    import rich
+    import rich.table
+    import rich.text
+    import rich.tree
+
     data = controller.get_checklist_data(checklist=checklist_name)
 
     if data is None:
         logging.error("%s is not a valid checklist", checklist_name)
         sys.exit(1)
 
-    symbol = ":arrow_forward:"
-    tree = rich.tree.Tree(
-        f"{_color_by_percent(symbol, data.complete)}{data.complete:4.0%} {checklist_name}"
+    seen_mark = rich.text.Text.from_markup("[green]:heavy_check_mark:[/green]")
+    unseen_mark = rich.text.Text.from_markup(
+        "[black]:black_medium_square:[/black]"
     )
+    tree = rich.tree.Tree(_progress_label(checklist_name, data.complete))
     for category, cat_data in sorted(data.categories.items()):
-        branch = tree.add(
-            f"{_color_by_percent(symbol, cat_data.complete)}{cat_data.complete:4.0%} {category}"
-        )
-        for species in sorted(cat_data.seen | cat_data.unseen):
-            mark = (
-                "[green]:heavy_check_mark:[/green]"
-                if species in cat_data.seen
-                else "[black]:black_medium_square:[/black]"
+        branch = tree.add(_progress_label(category, cat_data.complete))
+        # A single grid per category is far cheaper to build and render than
+        # a tree node for every species.
+        species_table = rich.table.Table.grid(padding=(0, 1))
+        for species, seen in cat_data.sorted_species:
+            species_table.add_row(
+                seen_mark if seen else unseen_mark, rich.text.Text(species)
             )
-            branch.add(f"{mark} {species}")
+        branch.add(species_table)
 
     rich.print(tree)
 
@@ -207,3 +339,17 @@ def show(checklist_name: str) -> None:
 def version() -> None:
     """Check the version number of the application."""
     print(f"birdr v{VERSION}")
+
+
+def run() -> None:
+    """Run the CLI, going straight to the command for a plain `show`.
+
+    `birdr show NAME` is run repeatedly while browsing checklists, so it
+    skips click's argument parsing. Any other arguments, including options
+    for show, go through the full command group.
+    """
+    args = sys.argv[1:]
+    if len(args) == 2 and args[0] == "show" and not args[1].startswith("-"):
+        _show_species(args[1])
+    else:
+        main()